@@ -1,26 +1,51 @@
+import atexit
 import os
+from functools import lru_cache
 from pathlib import Path
 
-import dspy
-from dotenv import load_dotenv
+import httpx
 from llama_index.core import Settings
 from llama_index.embeddings.openai import OpenAIEmbedding
 from llama_index.llms.openai import OpenAI
 
-if not load_dotenv(override=True):
-    print("Warning: No .env file found.")
+from env import ensure_env
+
+ensure_env()
 
 BASE_DIR = Path(__file__).parent
 DATA_DIR = BASE_DIR / "data"
 METADATA_FILE = BASE_DIR / "euro_ncap_metadata.csv"
 CHROMA_DIR = BASE_DIR / "chroma"
+PARSE_CACHE_DIR = BASE_DIR / ".cache" / "llamaparse"
+DSPY_CACHE_DIR = BASE_DIR / ".cache" / "dspy"
+OPTIMIZED_PLANNER_FILE = BASE_DIR / "optimized_planner.json"
+OPTIMIZED_SYNTHESIZER_FILE = BASE_DIR / "optimized_synthesizer.json"
 
 COLLECTION_NAME = "euro_ncap_knowledge_base"
+HNSW_EF_SEARCH = 64
 
 LLM_MODEL = "gpt-4o"
 EMBEDDING_MODEL = "text-embedding-3-small"
 TEMPERATURE = 0.0
 
+RERANK_MODEL = "rerank-multilingual-v3.0"
+SIMILARITY_TOP_K = 25
+FILTERED_TOP_K = 15
+NARROW_FILTERED_TOP_K = 8
+RERANK_TOP_N = 5
+RERANK_CONCURRENCY = 5
+MAX_NODE_CHARS = 4000
+
+SEMANTIC_CACHE_THRESHOLD = 0.92
+SEMANTIC_CACHE_SIZE = 1024
+RETRIEVAL_CACHE_THRESHOLD = 0.95
+RETRIEVER_CACHE_SIZE = 128
+QUERY_EMBEDDING_CACHE_SIZE = 1024
+
+EMBED_BATCH_SIZE = 100
+EMBED_NUM_WORKERS = 8
+PARSE_CONCURRENCY = 8
+
 COHERE_API_KEY = os.getenv("COHERE_API_KEY")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 LLAMA_CLOUD_API_KEY = os.getenv("LLAMA_CLOUD_API_KEY")
@@ -34,13 +59,50 @@ if not OPENAI_API_KEY:
 if not LLAMA_CLOUD_API_KEY:
     raise ValueError("CRITICAL: 'LLAMA_CLOUD_API_KEY' is missing in .env.")
 
+ENABLE_PHOENIX = os.getenv("ENABLE_PHOENIX") == "1"
+
 HTML_FILENAME = "workflow_graph.html"
 
+SHARED_HTTP = httpx.Client(http2=True, limits=httpx.Limits(max_keepalive_connections=32))
+SHARED_ASYNC_HTTP = httpx.AsyncClient(http2=True, limits=httpx.Limits(max_keepalive_connections=32))
+atexit.register(SHARED_HTTP.close)
+
 
+@lru_cache(maxsize=1)
+def get_chroma_client():
+    import chromadb
+
+    return chromadb.PersistentClient(path=str(CHROMA_DIR))
+
+
+async def close_shared_clients():
+    # One-shot teardown: the shared clients are not recreated, so call this once at process exit.
+    SHARED_HTTP.close()
+    await SHARED_ASYNC_HTTP.aclose()
+    get_chroma_client.cache_clear()
+
+
+@lru_cache(maxsize=1)
 def init_global_settings():
-    Settings.llm = OpenAI(model=LLM_MODEL, temperature=TEMPERATURE, api_key=OPENAI_API_KEY)
-    Settings.embed_model = OpenAIEmbedding(model=EMBEDDING_MODEL, api_key=OPENAI_API_KEY)
+    import dspy
+
+    Settings.llm = OpenAI(
+        model=LLM_MODEL,
+        temperature=TEMPERATURE,
+        api_key=OPENAI_API_KEY,
+        http_client=SHARED_HTTP,
+        async_http_client=SHARED_ASYNC_HTTP,
+    )
+    Settings.embed_model = OpenAIEmbedding(
+        model=EMBEDDING_MODEL,
+        api_key=OPENAI_API_KEY,
+        http_client=SHARED_HTTP,
+        async_http_client=SHARED_ASYNC_HTTP,
+    )
 
+    dspy.configure_cache(
+        enable_disk_cache=True, enable_memory_cache=True, disk_cache_dir=str(DSPY_CACHE_DIR)
+    )
     dspy_lm = dspy.LM(model=f"openai/{LLM_MODEL}", temperature=TEMPERATURE, api_key=OPENAI_API_KEY)
     dspy.configure(lm=dspy_lm)
 
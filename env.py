@@ -0,0 +1,15 @@
+from dotenv import load_dotenv
+
+_LOADED = False
+
+
+def ensure_env():
+    global _LOADED
+
+    if _LOADED:
+        return
+
+    if not load_dotenv(override=True):
+        print("Warning: No .env file found.")
+
+    _LOADED = True
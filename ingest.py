@@ -1,71 +1,161 @@
+import asyncio
+import hashlib
+import json
+import os
 import shutil
+import tempfile
+from functools import lru_cache
 from pathlib import Path
 
-import chromadb
 import pandas as pd
-from dotenv import load_dotenv
-from llama_index.core import Settings, StorageContext, VectorStoreIndex
+from llama_index.core import Document, Settings
 from llama_index.core.node_parser import MarkdownNodeParser
+from llama_index.core.schema import MetadataMode
 from llama_index.embeddings.openai import OpenAIEmbedding
 from llama_index.llms.openai import OpenAI
 from llama_index.vector_stores.chroma import ChromaVectorStore
-from llama_parse import LlamaParse
 
 from config import (
     CHROMA_DIR,
     COLLECTION_NAME,
     DATA_DIR,
+    EMBED_BATCH_SIZE,
+    EMBED_NUM_WORKERS,
     EMBEDDING_MODEL,
+    HNSW_EF_SEARCH,
     LLM_MODEL,
     METADATA_FILE,
+    PARSE_CACHE_DIR,
+    PARSE_CONCURRENCY,
+    SHARED_ASYNC_HTTP,
+    SHARED_HTTP,
     TEMPERATURE,
+    get_chroma_client,
 )
 
-load_dotenv()
-
-Settings.llm = OpenAI(model=LLM_MODEL, temperature=TEMPERATURE)
-Settings.embed_model = OpenAIEmbedding(model=EMBEDDING_MODEL)
+Settings.llm = OpenAI(
+    model=LLM_MODEL,
+    temperature=TEMPERATURE,
+    http_client=SHARED_HTTP,
+    async_http_client=SHARED_ASYNC_HTTP,
+)
+Settings.embed_model = OpenAIEmbedding(
+    model=EMBEDDING_MODEL,
+    embed_batch_size=EMBED_BATCH_SIZE,
+    num_workers=EMBED_NUM_WORKERS,
+    http_client=SHARED_HTTP,
+    async_http_client=SHARED_ASYNC_HTTP,
+)
 
-parser = LlamaParse(result_type="markdown", split_by_page=False)  # type: ignore
 node_parser = MarkdownNodeParser()
 
 if Path(CHROMA_DIR).exists():
     shutil.rmtree(CHROMA_DIR)
 
-chroma_client = chromadb.PersistentClient(path=str(CHROMA_DIR))
-chroma_collection = chroma_client.get_or_create_collection(name=COLLECTION_NAME)
+chroma_client = get_chroma_client()
+chroma_collection = chroma_client.get_or_create_collection(
+    name=COLLECTION_NAME, configuration={"hnsw": {"ef_search": HNSW_EF_SEARCH}}
+)
 vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
-storage_context = StorageContext.from_defaults(vector_store=vector_store)
-
-df = pd.read_csv(METADATA_FILE)
-metadata_map = {}
-
-for _, row in df.iterrows():
-    file_name = str(row["File Name"]).strip()
-    metadata_map[file_name] = {
-        "file_name": file_name,
-        "version": str(row["Version"]).strip(),
-        "start_date": int(str(row["Start Date"]).replace("-", "")),
-        "end_date": int(str(row["End Date"]).replace("-", "")),
-        "protocol_type": str(row["Protocol Type"]).strip(),
-        "system_domain": str(row["System Domain"]).strip(),
+
+
+def to_date_int(column):
+    dates = pd.to_datetime(column.str.strip(), format="%Y-%m-%d")
+    return dates.dt.strftime("%Y%m%d").astype("int64")
+
+
+df = pd.read_csv(METADATA_FILE, dtype=str)
+metadata_df = pd.DataFrame(
+    {
+        "file_name": df["File Name"].str.strip(),
+        "version": df["Version"].str.strip(),
+        "start_date": to_date_int(df["Start Date"]),
+        "end_date": to_date_int(df["End Date"]),
+        "protocol_type": df["Protocol Type"].str.strip(),
+        "system_domain": df["System Domain"].str.strip(),
     }
+)
+metadata_df["filter_key"] = metadata_df["protocol_type"] + "|" + metadata_df["version"]
+metadata_map = {record["file_name"]: record for record in metadata_df.to_dict(orient="records")}
+
+
+@lru_cache(maxsize=1)
+def get_parser():
+    from llama_parse import LlamaParse
+
+    return LlamaParse(result_type="markdown", split_by_page=False)  # type: ignore
+
+
+pdf_files = {}
+
+with os.scandir(DATA_DIR) as entries:
+    for entry in entries:
+        file_name = entry.name.removesuffix(".pdf").strip()
+        if entry.name.endswith(".pdf") and file_name in metadata_map:
+            pdf_files[file_name] = Path(entry.path)
+
+
+def file_digest(file_path):
+    with open(file_path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def read_cached_documents(cache_file):
+    if not cache_file.exists():
+        return None
+    return [Document.from_dict(doc) for doc in json.loads(cache_file.read_text(encoding="utf-8"))]
+
+
+def write_cached_documents(cache_file, docs):
+    fd, tmp_path = tempfile.mkstemp(dir=cache_file.parent, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump([doc.to_dict() for doc in docs], f)
+    os.replace(tmp_path, cache_file)
+
+
+async def parse_documents(file_paths):
+    PARSE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    sem = asyncio.Semaphore(PARSE_CONCURRENCY)
+
+    async def parse_one(file_path):
+        digest = await asyncio.to_thread(file_digest, file_path)
+        cache_file = PARSE_CACHE_DIR / f"{digest}.json"
+
+        cached = await asyncio.to_thread(read_cached_documents, cache_file)
+        if cached is not None:
+            return cached
+
+        async with sem:
+            file_docs = await get_parser().aload_data(str(file_path))
+
+        await asyncio.to_thread(write_cached_documents, cache_file, file_docs)
+        return file_docs
+
+    return await asyncio.gather(*(parse_one(fp) for fp in file_paths))
+
 
 documents = []
-pdf_files = list(DATA_DIR.glob("*.pdf"))
-
-for file_path in pdf_files:
-    file_name = file_path.stem.strip()
-    if file_name in metadata_map:
-        file_meta = metadata_map[file_name]
-        file_docs = parser.load_data(str(file_path))
-
-        for doc in file_docs:
-            doc.metadata.update(file_meta)
-            documents.append(doc)
-
-index = VectorStoreIndex.from_documents(
-    documents,
-    storage_context=storage_context,
-    transformations=[node_parser],
+
+parsed_files = asyncio.run(parse_documents(pdf_files.values()))
+
+for file_name, file_docs in zip(pdf_files, parsed_files, strict=True):
+    file_meta = metadata_map[file_name]
+
+    for doc in file_docs:
+        doc.metadata.update(file_meta)
+        doc.excluded_embed_metadata_keys.append("filter_key")
+        doc.excluded_llm_metadata_keys.append("filter_key")
+        documents.append(doc)
+
+nodes = node_parser.get_nodes_from_documents(documents, show_progress=True)
+
+embeddings = asyncio.run(
+    Settings.embed_model.aget_text_embedding_batch(
+        [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes], show_progress=True
+    )
 )
+
+for node, embedding in zip(nodes, embeddings, strict=True):
+    node.embedding = embedding
+
+vector_store.add(nodes)
@@ -1,54 +1,81 @@
 import asyncio
+import sys
 
-import chromadb
-import phoenix as px
-from dotenv import load_dotenv
 from llama_index.core import Settings, StorageContext, VectorStoreIndex, set_global_handler
 from llama_index.vector_stores.chroma import ChromaVectorStore
 
-from config import CHROMA_DIR, COLLECTION_NAME, init_global_settings
-from workflow import EuroNCAPWorkflow
-
-load_dotenv(override=True)
-
-session = px.launch_app()
-set_global_handler("arize_phoenix")
+from config import (
+    COLLECTION_NAME,
+    ENABLE_PHOENIX,
+    close_shared_clients,
+    get_chroma_client,
+    init_global_settings,
+)
+from workflow import ChunkEvent, EuroNCAPWorkflow
 
 
 async def main():
-    init_global_settings()
-
-    chroma_client = chromadb.PersistentClient(path=str(CHROMA_DIR))
-    chroma_collection = chroma_client.get_or_create_collection(COLLECTION_NAME)
-    vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
-
-    storage_context = StorageContext.from_defaults(vector_store=vector_store)
-    index = VectorStoreIndex.from_vector_store(
-        vector_store=vector_store, storage_context=storage_context, embed_model=Settings.embed_model
-    )
-
-    workflow = EuroNCAPWorkflow(index=index, timeout=120, verbose=True)
-
-    # query = "What is the capital of France?"
-    # query = "In v1.0 test protocol, which section mentioned test scenarios?"
-    # query = "In v4.3.1 test protocol, which section mentioned test scenarios?"
-    # query = "What test scenarios added in v4.3.1 compared to v1.0?"
-    # query = "In v4.3.1 test protocol, which test scenarios involve oncoming target?"
-    # query = "List test scenario changes among v1.0, 3.0.2, and 4.3.1."
-    # query = "Which test protocol was used in December 2020?"
-    # query = "In which test protocol is CCFtap first added?"
-    query = "What is the difference in CCRs scenario between v1.0 and 4.3.1?"
-
-    print("Question:")
-    print(query + "\n")
-
-    response = await workflow.run(query=query)
-
-    print("\nAnswer:")
-    print(response)
-
-    print(f"\nPlease visit Phoenix UI at: {session.url}")  # type: ignore
-    input("Press Enter to exit...")
+    session = None
+    if ENABLE_PHOENIX:
+        import phoenix as px
+
+        session = px.launch_app()
+        set_global_handler("arize_phoenix")
+
+    try:
+        init_global_settings()
+
+        chroma_client = get_chroma_client()
+        chroma_collection = chroma_client.get_or_create_collection(COLLECTION_NAME)
+        vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
+
+        storage_context = StorageContext.from_defaults(vector_store=vector_store)
+        index = VectorStoreIndex.from_vector_store(
+            vector_store=vector_store,
+            storage_context=storage_context,
+            embed_model=Settings.embed_model,
+        )
+
+        workflow = EuroNCAPWorkflow(index=index, timeout=120, verbose=True)
+
+        # query = "What is the capital of France?"
+        # query = "In v1.0 test protocol, which section mentioned test scenarios?"
+        # query = "In v4.3.1 test protocol, which section mentioned test scenarios?"
+        # query = "What test scenarios added in v4.3.1 compared to v1.0?"
+        # query = "In v4.3.1 test protocol, which test scenarios involve oncoming target?"
+        # query = "List test scenario changes among v1.0, 3.0.2, and 4.3.1."
+        # query = "Which test protocol was used in December 2020?"
+        # query = "In which test protocol is CCFtap first added?"
+        query = "What is the difference in CCRs scenario between v1.0 and 4.3.1?"
+
+        print("Question:")
+        print(query + "\n")
+
+        handler = workflow.run(query=query)
+
+        streamed = False
+        async for event in handler.stream_events():
+            if isinstance(event, ChunkEvent):
+                if not streamed:
+                    print("\nAnswer:")
+                    streamed = True
+                print(event.delta, end="", flush=True)
+
+        if streamed:
+            print()
+
+        response = await handler
+
+        if not streamed:
+            print("\nAnswer:")
+            print(response)
+
+        if session is not None:
+            print(f"\nPlease visit Phoenix UI at: {session.url}")  # type: ignore
+            if sys.stdin.isatty():
+                input("Press Enter to exit...")
+    finally:
+        await close_shared_clients()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,65 @@
+import asyncio
+from collections import defaultdict
+
+from llama_index.core.schema import MetadataMode, NodeWithScore
+
+from config import COHERE_API_KEY, RERANK_CONCURRENCY, RERANK_MODEL, SHARED_ASYNC_HTTP
+
+COHERE_RERANK_URL = "https://api.cohere.com/v1/rerank"
+
+COHERE_HEADERS = {"Authorization": f"Bearer {COHERE_API_KEY}"}
+
+_RERANK_SEMAPHORE = asyncio.Semaphore(RERANK_CONCURRENCY)
+
+
+async def cohere_rerank(query: str, nodes: list[NodeWithScore], top_n: int) -> list[NodeWithScore]:
+    if not nodes:
+        return []
+
+    documents = [node.node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+
+    async with _RERANK_SEMAPHORE:
+        response = await SHARED_ASYNC_HTTP.post(
+            COHERE_RERANK_URL,
+            headers=COHERE_HEADERS,
+            json={"model": RERANK_MODEL, "query": query, "documents": documents, "top_n": top_n},
+            timeout=10.0,
+        )
+    response.raise_for_status()
+
+    return [
+        NodeWithScore(node=nodes[result["index"]].node, score=result["relevance_score"])
+        for result in response.json()["results"]
+    ]
+
+
+async def batched_rerank(
+    pairs: list[tuple[str, list[NodeWithScore]]], top_n: int
+) -> list[list[NodeWithScore]]:
+    indices_by_query = defaultdict(list)
+    for i, (query, _) in enumerate(pairs):
+        indices_by_query[query].append(i)
+
+    async def rerank_group(query: str, indices: list[int]) -> dict[int, list[NodeWithScore]]:
+        if all(len(pairs[i][1]) <= top_n for i in indices):
+            return {i: pairs[i][1] for i in indices}
+
+        if len(indices) == 1:
+            return {indices[0]: await cohere_rerank(query, pairs[indices[0]][1], top_n)}
+
+        union = list({n.node.node_id: n for i in indices for n in pairs[i][1]}.values())
+        ranked = await cohere_rerank(query, union, len(union))
+
+        projected = {}
+        for i in indices:
+            node_ids = {n.node.node_id for n in pairs[i][1]}
+            projected[i] = [n for n in ranked if n.node.node_id in node_ids][:top_n]
+        return projected
+
+    reranked = {}
+    for group in await asyncio.gather(
+        *(rerank_group(query, indices) for query, indices in indices_by_query.items())
+    ):
+        reranked.update(group)
+
+    return [reranked[i] for i in range(len(pairs))]
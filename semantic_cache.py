@@ -0,0 +1,50 @@
+import re
+from collections import OrderedDict
+from collections.abc import Hashable
+from typing import Any
+
+import numpy as np
+
+# Version numbers, dates and scenario codes (e.g. "4.3.1", "2023", "CCRs", "VRU") change what a
+# query retrieves even when the embedding barely moves, so they must match exactly.
+IDENTIFIER_PATTERN = re.compile(r"\b(?:\w*\d[\w.]*|[A-Z]{2,}\w*)")
+
+
+def query_signature(text: str) -> frozenset[str]:
+    return frozenset(token.rstrip(".").upper() for token in IDENTIFIER_PATTERN.findall(text))
+
+
+class SemanticCache:
+    def __init__(self, threshold: float, max_size: int = 1024):
+        self.threshold = threshold
+        self.max_size = max_size
+        self._entries: OrderedDict[tuple, tuple[np.ndarray, Any]] = OrderedDict()
+
+    def lookup(self, text: str, embedding: list[float], key: Hashable = None) -> Any | None:
+        partition = (key, query_signature(text))
+        candidates = [entry_key for entry_key in self._entries if entry_key[0] == partition]
+        if not candidates:
+            return None
+
+        vectors = np.stack([self._entries[entry_key][0] for entry_key in candidates])
+        scores = vectors @ _normalize(embedding)
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+
+        self._entries.move_to_end(candidates[best])
+        return self._entries[candidates[best]][1]
+
+    def store(self, text: str, embedding: list[float], value: Any, key: Hashable = None) -> None:
+        entry_key = ((key, query_signature(text)), text)
+        self._entries[entry_key] = (_normalize(embedding), value)
+        self._entries.move_to_end(entry_key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+def _normalize(embedding: list[float]) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
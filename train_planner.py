@@ -1,7 +1,7 @@
 import dspy
 
-from config import LLM_MODEL, OPENAI_API_KEY, TEMPERATURE
-from planner_trainset import planner_trainset
+from config import LLM_MODEL, OPENAI_API_KEY, OPTIMIZED_PLANNER_FILE, TEMPERATURE
+from planner_trainset import get_planner_trainset
 from workflow import Planner
 
 LM = dspy.LM(model=f"openai/{LLM_MODEL}", temperature=TEMPERATURE, api_key=OPENAI_API_KEY)
@@ -162,7 +162,7 @@ planner_optimizer = dspy.BootstrapFewShotWithRandomSearch(
     num_threads=1,
 )
 
-optimized_planner = planner_optimizer.compile(Planner(), trainset=planner_trainset)
+optimized_planner = planner_optimizer.compile(Planner(), trainset=get_planner_trainset())
 
-optimized_planner.save("optimized_planner.json")
-print("Optimization complete. Optimized planner saved to optimized_planner.json")
+optimized_planner.save(OPTIMIZED_PLANNER_FILE)
+print(f"Optimization complete. Optimized planner saved to {OPTIMIZED_PLANNER_FILE.name}")
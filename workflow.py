@@ -1,8 +1,15 @@
-from datetime import datetime
+import asyncio
+import re
+import time
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from datetime import date, datetime
+from functools import cached_property, lru_cache, partial
 
 import dspy
-from llama_index.core import VectorStoreIndex
-from llama_index.core.schema import NodeWithScore
+from llama_index.core import Settings, VectorStoreIndex
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
 from llama_index.core.vector_stores import FilterOperator, MetadataFilter, MetadataFilters
 from llama_index.core.workflow import (
     Context,
@@ -12,10 +19,102 @@ from llama_index.core.workflow import (
     Workflow,
     step,
 )
-from llama_index.postprocessor.cohere_rerank import CohereRerank
 from pydantic import BaseModel, Field
 
-from config import COHERE_API_KEY
+from config import (
+    FILTERED_TOP_K,
+    MAX_NODE_CHARS,
+    NARROW_FILTERED_TOP_K,
+    OPTIMIZED_PLANNER_FILE,
+    OPTIMIZED_SYNTHESIZER_FILE,
+    QUERY_EMBEDDING_CACHE_SIZE,
+    RERANK_TOP_N,
+    RETRIEVAL_CACHE_THRESHOLD,
+    RETRIEVER_CACHE_SIZE,
+    SEMANTIC_CACHE_SIZE,
+    SEMANTIC_CACHE_THRESHOLD,
+    SIMILARITY_TOP_K,
+)
+from rerank import batched_rerank
+from semantic_cache import SemanticCache
+
+C2C_SCENARIO_CODES = r"CCR[smb]|CCFtap|CCCscp|CCFhol|CCFhos"
+VRU_SCENARIO_CODES = (
+    r"CP(?:FA|NA|NC|RA|RC|LA|TA)|CB(?:NAO|NA|FA|LA|TA|DA)|CM(?:Rs|Rb|Ftap|oncoming|overtaking)"
+)
+SYSTEM_DOMAIN_PATTERN = re.compile(
+    rf"(?P<c2c>\b(?:(?i:car-to-car|{C2C_SCENARIO_CODES})|C2C)\b)"
+    rf"|(?P<vru>\b(?:(?i:pedestrian|bicyclist|motorcyclist|{VRU_SCENARIO_CODES})|VRU)\b)"
+)
+SYSTEM_DOMAIN_BY_GROUP = {"c2c": "Car-to-Car", "vru": "Vulnerable Road User"}
+
+LTE_FILTER = partial(MetadataFilter, operator=FilterOperator.LTE)
+GTE_FILTER = partial(MetadataFilter, operator=FilterOperator.GTE)
+EQ_FILTER = partial(MetadataFilter, operator=FilterOperator.EQ)
+
+COMPLEX_QUERY_PATTERN = re.compile(
+    r"\d|\b(?:compar\w*|vs|versus|differ\w*|chang\w*|new|old|evolv\w*|evolution|histor\w*"
+    r"|introduc\w*|added|removed|updat\w*|revis\w*|versions?|first|latest|previous\w*|earlier"
+    r"|past|ago|ever|was|were|did|used|when|which|years?|since|until|before|after|between|over"
+    r"|and|or)\b",
+    re.IGNORECASE,
+)
+QUESTION_FILLER_PATTERN = re.compile(
+    r"\b(?:what|how|many|much|is|are|was|were|do|does|the|a|an|for|of|describe|list|tell|me"
+    r"|about|please)\b|[?.!,]",
+    re.IGNORECASE,
+)
+ASSESSMENT_PATTERN = re.compile(
+    r"\b(?:scor\w*|points?|stars?|ratings?|evaluat\w*)\b", re.IGNORECASE
+)
+
+
+def detect_system_domain(query: str) -> str | None:
+    domains = {
+        SYSTEM_DOMAIN_BY_GROUP[match.lastgroup] for match in SYSTEM_DOMAIN_PATTERN.finditer(query)
+    }
+    return domains.pop() if len(domains) == 1 else None
+
+
+@lru_cache(maxsize=1)
+def _today_for_minute(minute: int) -> str:
+    return datetime.now().strftime("%Y-%m-%d")
+
+
+def get_today() -> str:
+    return _today_for_minute(int(time.time() // 60))
+
+
+_QUERY_EMBEDDINGS: OrderedDict[str, list[float]] = OrderedDict()
+
+
+async def embed_query(text: str) -> list[float]:
+    embedding = _QUERY_EMBEDDINGS.get(text)
+    if embedding is None:
+        embedding = await Settings.embed_model.aget_query_embedding(text)
+        _QUERY_EMBEDDINGS[text] = embedding
+        if len(_QUERY_EMBEDDINGS) > QUERY_EMBEDDING_CACHE_SIZE:
+            _QUERY_EMBEDDINGS.popitem(last=False)
+    else:
+        _QUERY_EMBEDDINGS.move_to_end(text)
+    return embedding
+
+
+async def embed_queries(texts: list[str]) -> dict[str, list[float]]:
+    unique_texts = dict.fromkeys(texts)
+    result = {text: _QUERY_EMBEDDINGS[text] for text in unique_texts if text in _QUERY_EMBEDDINGS}
+    misses = [text for text in unique_texts if text not in result]
+    if misses:
+        embeddings = await Settings.embed_model.aget_text_embedding_batch(misses)
+        result.update(zip(misses, embeddings, strict=True))
+
+    for text, embedding in result.items():
+        _QUERY_EMBEDDINGS[text] = embedding
+        _QUERY_EMBEDDINGS.move_to_end(text)
+
+    while len(_QUERY_EMBEDDINGS) > QUERY_EMBEDDING_CACHE_SIZE:
+        _QUERY_EMBEDDINGS.popitem(last=False)
+    return result
 
 
 class RetrievalTask(BaseModel):
@@ -41,6 +140,17 @@ class RetrievalTask(BaseModel):
           **STRICTLY EXCLUDE** comparative terms like 'new', 'old', 'changed', 'difference', 'compare'.""",
     )
 
+    @cached_property
+    def target_date_int(self) -> int | None:
+        if self.mode != "precision" or not self.target_date:
+            return None
+        try:
+            return int(date.fromisoformat(self.target_date).strftime("%Y%m%d"))
+        except ValueError as e:
+            raise ValueError(
+                f"Precision task target_date must be YYYY-MM-DD, got {self.target_date!r}."
+            ) from e
+
 
 class RetrievalTaskList(BaseModel):
     tasks: list[RetrievalTask] = Field(
@@ -48,18 +158,57 @@ class RetrievalTaskList(BaseModel):
     )
 
 
-class RetrievalTaskEvent(Event):
-    task: RetrievalTask
+def retrieval_filter_key(task: RetrievalTask) -> tuple:
+    precision = task.mode == "precision"
+    return (
+        task.target_date_int,
+        task.target_version if precision else None,
+        task.protocol_type,
+    )
 
 
-class RetrievalResultEvent(Event):
+def is_tightly_filtered(task: RetrievalTask) -> bool:
+    return (
+        task.mode == "precision"
+        and task.target_date_int is not None
+        and bool(task.target_version)
+        and bool(task.protocol_type)
+    )
+
+
+def build_fast_path_plan(query: str, today: str) -> RetrievalTaskList | None:
+    system_domain = detect_system_domain(query)
+    if system_domain is None or COMPLEX_QUERY_PATTERN.search(query):
+        return None
+
+    protocol_type = "Assessment Protocol" if ASSESSMENT_PATTERN.search(query) else "Test Protocol"
+    return RetrievalTaskList(
+        tasks=[
+            RetrievalTask(
+                mode="precision",
+                target_date=today,
+                protocol_type=protocol_type,
+                system_domain=system_domain,
+                rewritten_query=" ".join(QUESTION_FILLER_PATTERN.sub(" ", query).split()),
+            )
+        ]
+    )
+
+
+@dataclass(slots=True)
+class RetrievalResult:
     nodes: list[NodeWithScore]
     task: RetrievalTask
 
 
 class AugmentedContextEvent(Event):
-    results: list[RetrievalResultEvent]
+    results: list[RetrievalResult]
     original_query: str
+    query_embedding: list[float]
+
+
+class ChunkEvent(Event):
+    delta: str
 
 
 class QueryToTasks(dspy.Signature):
@@ -135,35 +284,86 @@ class Planner(dspy.Module):
 
 
 class Synthesizer(dspy.Module):
-    def __init__(self):
+    def __init__(self, use_cot: bool = False):
         super().__init__()
-        self.prog = dspy.ChainOfThought(ContextToAnswer)
+        self.prog = (
+            dspy.ChainOfThought(ContextToAnswer) if use_cot else dspy.Predict(ContextToAnswer)
+        )
 
     def forward(self, context: str, query: str):
         return self.prog(context=context, query=query)
 
 
+@lru_cache(maxsize=1)
+def get_planner() -> Planner:
+    planner = Planner()
+    planner.load(OPTIMIZED_PLANNER_FILE)
+    return planner
+
+
+@lru_cache(maxsize=2)
+def get_synthesizer(use_cot: bool = False) -> Synthesizer:
+    synthesizer = Synthesizer(use_cot=use_cot)
+    if OPTIMIZED_SYNTHESIZER_FILE.exists():
+        synthesizer.load(OPTIMIZED_SYNTHESIZER_FILE)
+    return synthesizer
+
+
+@lru_cache(maxsize=2)
+def get_stream_synthesizer(use_cot: bool = False):
+    return dspy.streamify(
+        get_synthesizer(use_cot=use_cot),
+        stream_listeners=[
+            dspy.streaming.StreamListener(signature_field_name="answer", allow_reuse=True)
+        ],
+    )
+
+
 class EuroNCAPWorkflow(Workflow):
-    def __init__(self, index: VectorStoreIndex, timeout: int = 60, verbose: bool = True):
+    def __init__(
+        self,
+        index: VectorStoreIndex,
+        timeout: int = 60,
+        verbose: bool = True,
+        enable_fast_path: bool = True,
+        enable_cot_synth: bool = False,
+    ):
         super().__init__(timeout=timeout, verbose=verbose)
         self.index = index
+        self.enable_fast_path = enable_fast_path
 
-        self.dspy_planner = Planner()
-        self.dspy_planner.load("optimized_planner.json")
+        self.dspy_planner = get_planner()
+        self.stream_synthesizer = get_stream_synthesizer(use_cot=enable_cot_synth)
 
-        self.dspy_synthesizer = Synthesizer()
-        # self.dspy_synthesizer.load("optimized_synthesizer.json")
+        self._plan_cache = SemanticCache(SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_SIZE)
+        self._answer_cache = SemanticCache(SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_SIZE)
+        self._retrieval_cache = SemanticCache(RETRIEVAL_CACHE_THRESHOLD, SEMANTIC_CACHE_SIZE)
+        self._retrievers: dict[tuple, BaseRetriever] = {}
+        self._has_filter_key: bool | None = None
 
     @step
-    async def planner(self, ctx: Context, ev: StartEvent) -> RetrievalTaskEvent | StopEvent | None:
+    async def planner(self, ev: StartEvent) -> AugmentedContextEvent | StopEvent:
         print("[Planner] Decomposing query via DSPy...")
 
         query = ev.query
-        today_str = datetime.now().strftime("%Y-%m-%d")
+        today_str = get_today()
+
+        query_embedding = await embed_query(query)
 
-        prediction = self.dspy_planner(query=query, today=today_str)
+        plan = build_fast_path_plan(query, today_str) if self.enable_fast_path else None
+        if plan is not None:
+            print("[Planner] Simple single-topic query. Skipping DSPy decomposition.")
+        elif (plan := self._plan_cache.lookup(query, query_embedding, key=today_str)) is not None:
+            print("[Planner] Reusing cached plan for a semantically equivalent query.")
+        else:
+            prediction = self.dspy_planner(query=query, today=today_str)
+            plan = prediction.plan
+            self._plan_cache.store(
+                query, query_embedding, plan.model_copy(deep=True), key=today_str
+            )
 
-        plan = prediction.plan
+            if hasattr(prediction, "reasoning"):
+                print(f"[Planner Reasoning]: {prediction.reasoning}")
 
         task_count = len(plan.tasks)
 
@@ -171,131 +371,198 @@ class EuroNCAPWorkflow(Workflow):
             print("[Planner] No retrieval tasks generated. Reason: Out of domain knowledge.")
             return StopEvent(result="Sorry, I do not have the knowledge to answer that question.")
 
-        await ctx.store.set("total_tasks", task_count)
-        await ctx.store.set("results", [])
-        await ctx.store.set("original_query", query)
-
-        if hasattr(prediction, "reasoning"):
-            print(f"[Planner Reasoning]: {prediction.reasoning}")
-
         print(f"[Planner] Decomposition complete. Total tasks: {task_count}")
 
         for i, t in enumerate(plan.tasks):
             print(
                 f"   Task {i + 1}: [{t.mode}] Date={t.target_date} | Version={t.target_version} | Query='{t.rewritten_query}'"
             )
-            ctx.send_event(RetrievalTaskEvent(task=t))
-
-        return None
 
-    @step
-    async def retriever(self, ev: RetrievalTaskEvent) -> RetrievalResultEvent:
-        task = ev.task
-        print(f"[Retriever] Processing: {task.rewritten_query} (Mode={task.mode})")
+        embeddings = await embed_queries([t.rewritten_query for t in plan.tasks])
 
-        filters = []
-        if task.mode == "precision" and task.target_date:
-            target_date_int = int(task.target_date.replace("-", ""))
-            filters.extend(
-                [
-                    MetadataFilter(
-                        key="start_date", value=target_date_int, operator=FilterOperator.LTE
-                    ),
-                    MetadataFilter(
-                        key="end_date", value=target_date_int, operator=FilterOperator.GTE
-                    ),
-                ]
+        reranked = [
+            self._retrieval_cache.lookup(
+                t.rewritten_query, embeddings[t.rewritten_query], key=retrieval_filter_key(t)
             )
-
-        if task.mode == "precision" and task.target_version:
-            filters.append(
-                MetadataFilter(key="version", value=task.target_version, operator=FilterOperator.EQ)
+            for t in plan.tasks
+        ]
+        pending = [i for i, nodes in enumerate(reranked) if nodes is None]
+        if len(pending) < task_count:
+            print(f"[Retriever] Reusing cached results for {task_count - len(pending)} task(s).")
+
+        candidates = await asyncio.gather(
+            *(
+                self._retrieve_one(plan.tasks[i], embeddings[plan.tasks[i].rewritten_query])
+                for i in pending
             )
+        )
 
-        if task.protocol_type:
-            filters.append(
-                MetadataFilter(
-                    key="protocol_type", value=task.protocol_type, operator=FilterOperator.EQ
-                )
+        to_rerank = []
+        for i, nodes in zip(pending, candidates, strict=True):
+            if is_tightly_filtered(plan.tasks[i]):
+                reranked[i] = nodes[:RERANK_TOP_N]
+            else:
+                to_rerank.append((i, nodes))
+
+        fresh = await batched_rerank(
+            [(plan.tasks[i].rewritten_query, nodes) for i, nodes in to_rerank],
+            top_n=RERANK_TOP_N,
+        )
+        for (i, _), nodes in zip(to_rerank, fresh, strict=True):
+            reranked[i] = nodes
+
+        for i in pending:
+            t = plan.tasks[i]
+            self._retrieval_cache.store(
+                t.rewritten_query,
+                embeddings[t.rewritten_query],
+                reranked[i],
+                key=retrieval_filter_key(t),
             )
+        print(
+            f"[Retriever] Reranking complete. Selected nodes per task: {[len(n) for n in reranked]}"
+        )
 
-        metadata_filters = MetadataFilters(filters=filters) if filters else None
+        results = [
+            RetrievalResult(nodes=nodes, task=t)
+            for t, nodes in zip(plan.tasks, reranked, strict=True)
+        ]
+        print("[Planner] All retrieval tasks complete. Proceeding to Synthesizer.")
 
-        vector_retriever = self.index.as_retriever(
-            similarity_top_k=30,
-            filters=metadata_filters,
+        return AugmentedContextEvent(
+            results=results, original_query=query, query_embedding=query_embedding
         )
-        vector_nodes = await vector_retriever.aretrieve(task.rewritten_query)
 
-        if vector_nodes:
-            reranker = CohereRerank(
-                top_n=5, model="rerank-multilingual-v3.0", api_key=COHERE_API_KEY
-            )
-            reranked_nodes = reranker.postprocess_nodes(
-                vector_nodes, query_str=task.rewritten_query
-            )
-            print(f"[Retriever] Reranking complete. Selected top {len(reranked_nodes)} nodes")
-        else:
-            reranked_nodes = []
-            print("[Retriever] No nodes found via vector search.")
+    async def _retrieve_one(
+        self, task: RetrievalTask, query_embedding: list[float]
+    ) -> list[NodeWithScore]:
+        print(f"[Retriever] Processing: {task.rewritten_query} (Mode={task.mode})")
 
-        return RetrievalResultEvent(nodes=reranked_nodes, task=task)
+        vector_retriever = self._get_retriever(retrieval_filter_key(task))
+        vector_nodes = await asyncio.to_thread(
+            vector_retriever.retrieve,
+            QueryBundle(query_str=task.rewritten_query, embedding=query_embedding),
+        )
 
-    @step
-    async def aggregator(
-        self, ctx: Context, ev: RetrievalResultEvent
-    ) -> AugmentedContextEvent | None:
-        total_tasks = await ctx.store.get("total_tasks")
-        original_query = await ctx.store.get("original_query")
+        if not vector_nodes:
+            print(f"[Retriever] No nodes found via vector search for '{task.rewritten_query}'.")
 
-        results = await ctx.store.get("results", default=[])
-        results.append(ev)
-        await ctx.store.set("results", results)
+        return vector_nodes
 
-        current_count = len(results)
-        print(f"[Aggregator] Received result {current_count}/{total_tasks}...")
+    def _store_has_filter_key(self) -> bool:
+        if self._has_filter_key is None:
+            sample = self.index.vector_store.client.get(limit=1, include=["metadatas"])
+            metadatas = sample["metadatas"] or []
+            self._has_filter_key = not metadatas or "filter_key" in metadatas[0]
+            if not self._has_filter_key:
+                print(
+                    "[Retriever] Collection predates the 'filter_key' metadata. "
+                    "Falling back to separate version/protocol filters; re-run ingest.py to upgrade."
+                )
+        return self._has_filter_key
 
-        if current_count >= total_tasks:
-            print("[Aggregator] All results collected. Proceeding to Synthesizer.")
+    def _get_retriever(self, filter_key: tuple) -> BaseRetriever:
+        retriever = self._retrievers.get(filter_key)
+        if retriever is not None:
+            return retriever
 
-            return AugmentedContextEvent(results=results, original_query=original_query)
+        target_date_int, target_version, protocol_type = filter_key
 
-        return None
+        filters = []
+        if target_date_int is not None:
+            filters.extend(
+                [
+                    LTE_FILTER(key="start_date", value=target_date_int),
+                    GTE_FILTER(key="end_date", value=target_date_int),
+                ]
+            )
+
+        if target_version and protocol_type and self._store_has_filter_key():
+            filters.append(EQ_FILTER(key="filter_key", value=f"{protocol_type}|{target_version}"))
+        else:
+            if target_version:
+                filters.append(EQ_FILTER(key="version", value=target_version))
+            if protocol_type:
+                filters.append(EQ_FILTER(key="protocol_type", value=protocol_type))
+
+        metadata_filters = MetadataFilters(filters=filters) if filters else None
+
+        constraint_count = sum(value is not None for value in filter_key)
+        if constraint_count == 0:
+            similarity_top_k = SIMILARITY_TOP_K
+        elif constraint_count <= 2:
+            similarity_top_k = FILTERED_TOP_K
+        else:
+            similarity_top_k = NARROW_FILTERED_TOP_K
+
+        retriever = self.index.as_retriever(
+            similarity_top_k=similarity_top_k,
+            filters=metadata_filters,
+        )
+
+        if len(self._retrievers) >= RETRIEVER_CACHE_SIZE:
+            self._retrievers.pop(next(iter(self._retrievers)))
+        self._retrievers[filter_key] = retriever
+        return retriever
 
     @step
-    async def synthesizer(self, ev: AugmentedContextEvent) -> StopEvent:
+    async def synthesizer(self, ctx: Context, ev: AugmentedContextEvent) -> StopEvent:
         print("[Synthesizer] Generating response via DSPy...")
 
         context_parts = []
-        has_content = False
+        seen_node_ids = set()
 
         for i, result in enumerate(ev.results):
             task_info = result.task
-            if not result.nodes:
+            nodes = [n for n in result.nodes if n.node.node_id not in seen_node_ids]
+            if not nodes:
                 continue
+            seen_node_ids.update(n.node.node_id for n in nodes)
 
-            has_content = True
             label = (
                 f"Source {i + 1} (Date: {task_info.target_date or 'Any'}, Mode: {task_info.mode})"
             )
 
-            content = ""
-            for node in result.nodes:
+            texts_by_file = defaultdict(list)
+            for node in nodes:
                 file_name = node.node.metadata.get("file_name", "Unknown File")
-                content += f"\n[File: {file_name}]\n{node.node.get_content()}\n"
+                texts_by_file[file_name].append(node.node.get_content()[:MAX_NODE_CHARS])
+
+            content = "".join(
+                f"\n[File: {file_name}]\n" + "\n---\n".join(texts) + "\n"
+                for file_name, texts in texts_by_file.items()
+            )
             context_parts.append(f"=== {label} ===\n{content}\n")
 
-        if not has_content:
+        if not context_parts:
             return StopEvent(
                 result="Sorry, I could not find any relevant information in the provided protocols matching your criteria."
             )
 
         full_context = "\n".join(context_parts)
+        context_key = hash(full_context)
+
+        answer = self._answer_cache.lookup(ev.original_query, ev.query_embedding, key=context_key)
+        if answer is not None:
+            print("[Synthesizer] Reusing cached answer for a semantically equivalent query.")
+            return StopEvent(result=answer)
 
-        prediction = self.dspy_synthesizer(context=full_context, query=ev.original_query)
+        prediction = None
+        async for chunk in self.stream_synthesizer(context=full_context, query=ev.original_query):
+            if isinstance(chunk, dspy.streaming.StreamResponse):
+                ctx.write_event_to_stream(ChunkEvent(delta=chunk.chunk))
+            elif isinstance(chunk, dspy.Prediction):
+                prediction = chunk
 
-        print(f"[Synthesizer Reasoning]: {prediction.reasoning}")
+        if prediction is None:
+            raise RuntimeError("Synthesizer stream ended without a final prediction.")
+
+        if hasattr(prediction, "reasoning"):
+            print(f"[Synthesizer Reasoning]: {prediction.reasoning}")
 
         print("[Synthesizer] Response generated.")
 
-        return StopEvent(result=str(prediction.answer))
+        answer = str(prediction.answer)
+        self._answer_cache.store(ev.original_query, ev.query_embedding, answer, key=context_key)
+
+        return StopEvent(result=answer)